@@ -0,0 +1,272 @@
+import json
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+from config import ANALYTICS_REFRESH_INTERVAL
+from database import get_connection
+from jobs import JOBS_CHANNEL
+from logging_config import logger
+
+# Resultados das queries de /sales/*, aquecidos pelo job warm_analytics
+analytics_cache = {}
+
+# Chave do snapshot com todas as categorias existentes
+CATEGORIES_KEY = ("categories",)
+
+TOP_PRODUCTS_QUERY = """
+select comb.ProductKey, comb.ProductName, sum(vendas) as total_vendas from(
+select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod
+inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
+inner join sales_2016 as s16 on s16.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
+group by prod.Productkey
+union all
+select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod
+inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
+inner join sales_2017 as s17 on s17.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
+group by prod.Productkey
+union all
+select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod
+inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
+inner join sales_2015 as s15 on s15.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
+group by prod.Productkey
+) as comb group by comb.ProductKey, comb.ProductName order by total_vendas desc limit 10;
+"""
+
+BEST_CUSTOMER_QUERY = """
+select comb.CustomerKey, comb.FirstName, comb.LastName, sum(compras) as total_compras from(
+select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
+inner join sales_2015 as s15 on s15.CustomerKey = cus.CustomerKey
+group by cus.CustomerKey
+union all
+select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
+inner join sales_2016 as s16 on s16.CustomerKey = cus.CustomerKey
+group by cus.CustomerKey
+union all
+select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
+inner join sales_2017 as s17 on s17.CustomerKey = cus.CustomerKey
+group by cus.CustomerKey
+)as comb group by comb.CustomerKey, comb.FirstName, comb.LastName order by total_compras desc limit 1;
+"""
+
+BUSIEST_MONTH_QUERY = """
+select comb.mes, sum(valor) as total_valor from(
+select month(str_to_date(s15.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2015 as s15
+inner join products as prod on prod.ProductKey = s15.ProductKey group by mes
+union all
+select month(str_to_date(s16.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2016 as s16
+inner join products as prod on prod.ProductKey = s16.ProductKey group by mes
+union all
+select month(str_to_date(s17.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2017 as s17
+inner join products as prod on prod.ProductKey = s17.ProductKey group by mes
+)as comb group by comb.mes order by total_valor desc limit 1;
+"""
+
+TOP_TERRITORIES_QUERY = """
+select s17.TerritoryKey, round(sum(prod.ProductPrice),2) as valor_acima_media from sales_2017 as s17
+inner join products as prod on prod.ProductKey = s17.Productkey group by s17.TerritoryKey
+having round(sum(prod.ProductPrice),2) >= (
+select round(sum(prod.ProductPrice),2) / count(distinct TerritoryKey) as valor from sales_2017 as s17
+inner join products as prod on prod.ProductKey = s17.Productkey
+) order by valor_acima_media desc;
+"""
+
+CATEGORIES_QUERY = "select distinct ProductCategoryKey from product_subcategories"
+
+
+def run_query(db, query: str, params=None):
+    cursor = db.cursor()
+    if params is None:
+        cursor.execute(query)
+    else:
+        cursor.execute(query, params)
+    result = cursor.fetchall()
+    cursor.close()
+    return result
+
+
+def top_products(db, category: int):
+    return run_query(db, TOP_PRODUCTS_QUERY, (category, category, category))
+
+
+def best_customer(db):
+    return run_query(db, BEST_CUSTOMER_QUERY)
+
+
+def busiest_month(db):
+    return run_query(db, BUSIEST_MONTH_QUERY)
+
+
+def top_territories(db):
+    return run_query(db, TOP_TERRITORIES_QUERY)
+
+
+def _compute(compute, connector, *args):
+    db = connector()
+    try:
+        return compute(db, *args)
+    finally:
+        db.close()
+
+
+async def cached(key, compute, connector, *args):
+    """Devolve o resultado do cache, consultando o banco fora do event loop só em um miss."""
+    if key in analytics_cache:
+        return analytics_cache[key]
+    # Depois do warm o snapshot lista todas as categorias, então a que não está
+    # nele não existe
+    if key[0] == "top-products" and CATEGORIES_KEY in analytics_cache:
+        return []
+    result = await run_in_threadpool(_compute, compute, connector, *args)
+    # Resultados vazios (ex: categoria inexistente) não são guardados, assim o
+    # cache só cresce com as categorias que existem
+    if result:
+        analytics_cache[key] = result
+    return result
+
+
+def clear_cache():
+    analytics_cache.clear()
+
+
+class SnapshotStore:
+    """Snapshot dos resultados guardado no Redis e compartilhado entre os workers."""
+
+    snapshot_key = "analytics:snapshot"
+    lock_key = "analytics:lock"
+    # Tempo máximo que um worker pode segurar o lock calculando o snapshot
+    lock_ttl = 300
+
+    release_script = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.from_url(url)
+        self.token = uuid.uuid4().hex
+        self._release = self.client.register_script(self.release_script)
+
+    def load(self):
+        data = self.client.get(self.snapshot_key)
+        if data is None:
+            return None
+        snapshot = json.loads(data)
+        results = {tuple(key): value for key, value in snapshot["results"]}
+        return snapshot["computed_at"], results
+
+    def save(self, results):
+        snapshot = {
+            "computed_at": time.time(),
+            "results": jsonable_encoder([[list(key), value] for key, value in results.items()]),
+        }
+        self.client.set(self.snapshot_key, json.dumps(snapshot))
+
+    def acquire(self):
+        return bool(self.client.set(self.lock_key, self.token, nx=True, ex=self.lock_ttl))
+
+    def release(self):
+        self._release(keys=[self.lock_key], args=[self.token])
+
+    def publish_load(self):
+        self.client.publish(JOBS_CHANNEL, "load_analytics")
+
+    def close(self):
+        self.client.close()
+
+
+# Store do worker, criado e fechado pelo lifespan do main.py quando há REDIS_URL
+_store: SnapshotStore | None = None
+
+
+def init_store(url: str | None):
+    global _store
+    if url:
+        _store = SnapshotStore(url)
+
+
+def close_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def compute_analytics():
+    db = get_connection()
+    try:
+        results = {
+            ("best-customer",): best_customer(db),
+            ("busiest-month",): busiest_month(db),
+            ("top-territories",): top_territories(db),
+        }
+        categories = [category for (category,) in run_query(db, CATEGORIES_QUERY)]
+        for category in categories:
+            results[("top-products", category)] = top_products(db, category)
+        results[CATEGORIES_KEY] = categories
+    finally:
+        db.close()
+    return results
+
+
+def _apply(results):
+    # O cache passa a ser exatamente o snapshot recalculado
+    for key in set(analytics_cache) - set(results):
+        analytics_cache.pop(key, None)
+    analytics_cache.update(results)
+
+
+def warm_analytics(force: bool = False):
+    """Atualiza o cache de /sales/*.
+
+    Com o Redis, só o worker que pega o lock roda as queries e salva o snapshot;
+    os outros esperam e carregam o snapshot salvo. Sem force, um snapshot mais
+    novo que ANALYTICS_REFRESH_INTERVAL é reaproveitado.
+    """
+    if _store is None:
+        results = compute_analytics()
+        _apply(results)
+        logger.info(f"Analytics cache warmed with {len(results)} results")
+        return
+    deadline = time.monotonic() + SnapshotStore.lock_ttl
+    while True:
+        if not force:
+            snapshot = _store.load()
+            if snapshot is not None and time.time() - snapshot[0] < ANALYTICS_REFRESH_INTERVAL:
+                _apply(snapshot[1])
+                return
+        if _store.acquire():
+            try:
+                results = compute_analytics()
+                _store.save(results)
+            finally:
+                _store.release()
+            _apply(results)
+            if force:
+                # Os outros workers carregam o snapshot novo sem recalcular
+                _store.publish_load()
+            logger.info(f"Analytics snapshot computed with {len(results)} results")
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Timed out waiting for the analytics snapshot lock")
+        time.sleep(0.5)
+
+
+def refresh_analytics():
+    """Recalcula o snapshot depois de uma escrita em products."""
+    warm_analytics(force=True)
+
+
+def load_analytics():
+    """Carrega o snapshot salvo por outro worker."""
+    if _store is None:
+        return
+    snapshot = _store.load()
+    if snapshot is not None:
+        _apply(snapshot[1])
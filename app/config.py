@@ -0,0 +1,28 @@
+import os
+
+from mysql.connector.pooling import CNX_POOL_MAXSIZE
+
+# Configurações lidas das variáveis de ambiente (docker-compose.yml)
+DATABASE_URL = os.getenv("DATABASE_URL", "mysql://user:pass@db/adventure")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+if not 1 <= DB_POOL_SIZE <= CNX_POOL_MAXSIZE:
+    raise ValueError(f"DB_POOL_SIZE must be between 1 and {CNX_POOL_MAXSIZE}, got {DB_POOL_SIZE}")
+# Tempo máximo em segundos esperando uma conexão livre no pool
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+# Redis usado para avisar todos os workers sobre os triggers dos jobs
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Intervalo em segundos para recalcular as rotas de /sales/*
+ANALYTICS_REFRESH_INTERVAL = int(os.getenv("ANALYTICS_REFRESH_INTERVAL", "3600"))
+
+# Token bucket de cada cliente: capacidade e tokens recarregados por segundo
+RATE_LIMIT_CAPACITY = int(os.getenv("RATE_LIMIT_CAPACITY", "60"))
+RATE_LIMIT_REFILL_RATE = float(os.getenv("RATE_LIMIT_REFILL_RATE", "1"))
+# Com a URL definida os limites são compartilhados entre os workers pelo Redis
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
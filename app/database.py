@@ -1,12 +1,114 @@
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
 import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+from fastapi import HTTPException, status
+
+from config import DATABASE_URL, DB_POOL_SIZE, DB_POOL_TIMEOUT
+from logging_config import logger
+
+
+def parse_database_url(url: str):
+    parsed = urlparse(url)
+    return {
+        "host": parsed.hostname,
+        "port": parsed.port or 3306,
+        "user": unquote(parsed.username or ""),
+        "password": unquote(parsed.password or ""),
+        "database": parsed.path.lstrip("/"),
+        "charset": "utf8mb4",
+        "collation": "utf8mb4_unicode_ci",
+    }
+
+
+DB_CONFIG = parse_database_url(DATABASE_URL)
+
+# Intervalo mínimo em segundos entre tentativas de criar o pool
+POOL_RETRY_INTERVAL = 1.0
+
+# Pool do worker, criado e fechado pelo lifespan do main.py
+_pool: pooling.MySQLConnectionPool | None = None
+_pool_lock = threading.Lock()
+_last_pool_attempt = float("-inf")
+
+
+def init_pool():
+    global _pool, _last_pool_attempt
+    _last_pool_attempt = time.monotonic()
+    try:
+        _pool = pooling.MySQLConnectionPool(
+            pool_name="adventure", pool_size=DB_POOL_SIZE, **DB_CONFIG
+        )
+        logger.info(f"Connection pool created with {DB_POOL_SIZE} connections")
+    except mysql.connector.Error as e:
+        logger.error(f"Failed to create connection pool, retrying on the next request: {e}")
+
+
+def _get_pool():
+    # Se o banco ainda não estava pronto no startup, o pool é criado na primeira
+    # requisição depois dele subir
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None and time.monotonic() - _last_pool_attempt >= POOL_RETRY_INTERVAL:
+                init_pool()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        # O mysql.connector não expõe um método público para fechar o pool.
+        # Só as conexões livres são fechadas: as que ainda estão em uso não
+        # voltam mais para o pool e são fechadas quando o processo termina.
+        # O uvicorn só roda o shutdown depois de esperar as requisições em andamento
+        _pool._remove_connections()
+        _pool = None
+
+
+def connect():
+    """Abre uma conexão nova, fora do pool."""
+    return mysql.connector.connect(**DB_CONFIG)
+
+
+def get_connector():
+    """Dependência para quem abre e fecha a própria conexão, como as exportações."""
+    return connect
+
+
+def get_pooled_connector():
+    """Dependência para quem só abre uma conexão do pool quando precisa."""
+    return get_connection
+
+
+def get_connection():
+    """Pega uma conexão do pool, esperando até DB_POOL_TIMEOUT segundos por uma livre."""
+    pool = _get_pool()
+    if pool is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database unavailable, try again later",
+        )
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            return pool.get_connection()
+        except PoolError:
+            # O pool do mysql.connector não espera por conexões, então tentamos de novo
+            if time.monotonic() >= deadline:
+                logger.warning("Connection pool exhausted")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Database busy, try again later",
+                )
+            time.sleep(0.05)
+
 
 def get_db():
-    conn = mysql.connector.connect(
-        host="db",
-        user="user",
-        password="pass",
-        database="adventure",
-        charset="utf8mb4",
-        collation="utf8mb4_unicode_ci",
-    )
-    return conn
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
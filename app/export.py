@@ -0,0 +1,168 @@
+import io
+from typing import Literal
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+from mysql.connector.constants import FieldFlag, FieldType
+
+# Quantidade de linhas lidas do cursor por vez
+EXPORT_BATCH_SIZE = 5000
+
+# Charset que o MySQL usa para colunas binárias
+BINARY_CHARSET = 63
+
+_INTEGER_TYPES = {
+    FieldType.TINY, FieldType.SHORT, FieldType.INT24, FieldType.LONG,
+    FieldType.LONGLONG, FieldType.YEAR, FieldType.BIT,
+}
+_STRING_TYPES = {
+    FieldType.VARCHAR, FieldType.VAR_STRING, FieldType.STRING,
+    FieldType.ENUM, FieldType.SET, FieldType.JSON,
+}
+_BLOB_TYPES = {
+    FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB, FieldType.BLOB,
+}
+
+# Marca as colunas DECIMAL, cuja escala só é conhecida pelos valores do primeiro batch
+DECIMAL = "decimal"
+
+ExportFormat = Literal["csv", "parquet", "arrow"]
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    # Arquivo em memória que é esvaziado a cada batch enviado ao cliente
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _open_writer(export_format: str, sink, schema: pa.Schema):
+    if export_format == "csv":
+        return pa_csv.CSVWriter(sink, schema)
+    if export_format == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    return pa_ipc.new_stream(sink, schema)
+
+
+def _arrow_type(column):
+    # Tipo Arrow a partir do cursor.description do mysql.connector
+    type_code, flags = column[1], column[7] if len(column) > 7 else 0
+    if type_code in _INTEGER_TYPES:
+        if type_code == FieldType.LONGLONG and flags & FieldFlag.UNSIGNED:
+            return pa.uint64()
+        return pa.int64()
+    if type_code in (FieldType.FLOAT, FieldType.DOUBLE):
+        return pa.float64()
+    if type_code in (FieldType.DECIMAL, FieldType.NEWDECIMAL):
+        return DECIMAL
+    if type_code in (FieldType.DATE, FieldType.NEWDATE):
+        return pa.date32()
+    if type_code in (FieldType.DATETIME, FieldType.TIMESTAMP):
+        return pa.timestamp("us")
+    if type_code == FieldType.TIME:
+        return pa.duration("us")
+    if type_code in _STRING_TYPES:
+        return pa.string()
+    if type_code in _BLOB_TYPES:
+        return pa.binary() if column[8] == BINARY_CHARSET else pa.string()
+    return None
+
+
+def _decimal_type(column):
+    # O conector não informa precisão e escala no description, mas o MySQL sempre
+    # devolve os valores com a escala da coluna, então ela vem do primeiro batch
+    inferred = pa.array(column).type
+    if not pa.types.is_decimal(inferred):
+        # Coluna toda NULL no primeiro batch: sem escala, o valor exato vai como texto
+        return pa.string()
+    if pa.types.is_decimal256(inferred) and inferred.precision > 38:
+        return pa.decimal256(76, inferred.scale)
+    return pa.decimal128(38, inferred.scale)
+
+
+def _resolve_schema(names, types, columns):
+    # Fixa o schema no primeiro batch. Tipos desconhecidos (sqlite dos testes)
+    # são inferidos dos valores
+    fields = []
+    for name, arrow_type, column in zip(names, types, columns):
+        if arrow_type is DECIMAL:
+            arrow_type = _decimal_type(column)
+        elif arrow_type is None:
+            arrow_type = pa.array(column).type
+        fields.append((name, arrow_type))
+    return pa.schema(fields)
+
+
+def _to_array(column, arrow_type):
+    if pa.types.is_string(arrow_type):
+        # Decimal e outros valores são convertidos pelo pyarrow e depois viram texto
+        return pa.array(column).cast(arrow_type)
+    return pa.array(column, type=arrow_type)
+
+
+def _to_record_batch(columns, schema: pa.Schema):
+    arrays = [_to_array(column, field.type) for column, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def stream_query(connector, query: str, params, export_format: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """Abre uma conexão, executa a query em um cursor não bufferizado e gera o resultado em chunks de bytes."""
+    # A conexão só é aberta quando o streaming começa, e é sempre fechada por ele
+    db = connector()
+    try:
+        # O cursor padrão do mysql.connector não é bufferizado: as linhas só saem do
+        # servidor conforme o fetchmany avança
+        cursor = db.cursor()
+        cursor.execute(query, params)
+        names = [col[0] for col in cursor.description]
+        types = [_arrow_type(column) for column in cursor.description]
+        sink = _ChunkSink()
+        writer = None
+        schema = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            # Transpõe as linhas do batch em colunas e converte cada coluna de uma vez
+            columns = list(zip(*rows))
+            if writer is None:
+                # Todos os batches seguintes são convertidos para o mesmo schema
+                schema = _resolve_schema(names, types, columns)
+                writer = _open_writer(export_format, sink, schema)
+            writer.write_batch(_to_record_batch(columns, schema))
+            yield sink.drain()
+        if writer is None:
+            schema = pa.schema([
+                (name, pa.string() if arrow_type is None or arrow_type is DECIMAL else arrow_type)
+                for name, arrow_type in zip(names, types)
+            ])
+            writer = _open_writer(export_format, sink, schema)
+        writer.close()
+        yield sink.drain()
+    finally:
+        # Fechar a conexão descarta as linhas não lidas caso o cliente desconecte
+        db.close()
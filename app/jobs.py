@@ -0,0 +1,151 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from logging_config import logger
+
+# Canal do Redis em que os workers recebem triggers dos outros workers
+JOBS_CHANNEL = "jobs:trigger"
+
+
+class Job:
+    def __init__(self, name: str, func, interval: float | None, on_startup: bool):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.on_startup = on_startup
+        self.event: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self.running = False
+        self.runs = 0
+        self.last_status: str | None = None
+        self.last_started: datetime | None = None
+        self.last_duration: float | None = None
+        self.last_error: str | None = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "last_status": self.last_status,
+            "last_started": self.last_started,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    """Executa jobs registrados por intervalo ou por trigger em um executor separado."""
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self.jobs: dict[str, Job] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._redis = None
+        self._listener: asyncio.Task | None = None
+
+    def register(self, name: str, func, interval: float | None = None, on_startup: bool = False):
+        self.jobs[name] = Job(name, func, interval, on_startup)
+
+    def trigger(self, name: str):
+        # Sem o scheduler rodando (ex: nos testes) o trigger é ignorado
+        job = self.jobs.get(name)
+        if job is not None and job.event is not None:
+            job.event.set()
+
+    async def broadcast(self, name: str):
+        # Com o Redis configurado o trigger chega a todos os workers, inclusive este
+        if self._redis is None:
+            self.trigger(name)
+            return
+        try:
+            await self._redis.publish(JOBS_CHANNEL, name)
+        except Exception as e:
+            logger.error(f"Failed to broadcast job {name}: {e}")
+            self.trigger(name)
+
+    def status(self):
+        return [job.status() for job in self.jobs.values()]
+
+    async def start(self, redis_url: str | None = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="jobs"
+        )
+        for job in self.jobs.values():
+            job.event = asyncio.Event()
+            if job.on_startup:
+                job.event.set()
+            job.task = asyncio.create_task(self._loop(job))
+        if redis_url:
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(redis_url)
+            self._listener = asyncio.create_task(self._listen())
+        logger.info(f"Scheduler started with jobs: {', '.join(self.jobs)}")
+
+    async def stop(self):
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        if self._listener is not None:
+            tasks.append(self._listener)
+            self._listener = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.task = None
+            job.event = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("Scheduler stopped")
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(JOBS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.trigger(message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Jobs channel listener failed, retrying: {e}")
+                await asyncio.sleep(1)
+
+    async def _loop(self, job: Job):
+        while True:
+            try:
+                await asyncio.wait_for(job.event.wait(), timeout=job.interval)
+            except TimeoutError:
+                pass
+            # Triggers recebidos durante a execução geram uma única nova execução
+            job.event.clear()
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        loop = asyncio.get_running_loop()
+        job.running = True
+        job.last_started = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._executor, job.func)
+            job.last_status = "success"
+            job.last_error = None
+        except Exception as e:
+            job.last_status = "failed"
+            job.last_error = str(e)
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_duration = round(time.perf_counter() - start, 4)
+
+
+scheduler = Scheduler()
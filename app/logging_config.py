@@ -1,4 +1,6 @@
 import logging
+import logging.handlers
+import queue
 
 # Configura o logger para gravar logs em um arquivo
 logging.basicConfig(
@@ -8,3 +10,28 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+
+_listener: logging.handlers.QueueListener | None = None
+_file_handlers: list[logging.Handler] = []
+
+
+def start_log_listener():
+    # Os handlers de arquivo passam a rodar em uma thread do listener,
+    # as rotas só colocam o registro na fila
+    global _listener, _file_handlers
+    root = logging.getLogger()
+    _file_handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(
+        log_queue, *_file_handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def stop_log_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger().handlers = _file_handlers
@@ -1,6 +1,50 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from routes import router as product_router
+from analytics import (
+    clear_cache,
+    close_store,
+    init_store,
+    load_analytics,
+    refresh_analytics,
+    warm_analytics,
+)
+from config import ANALYTICS_REFRESH_INTERVAL, REDIS_URL
+from database import init_pool, close_pool
+from jobs import scheduler
+from logging_config import start_log_listener, stop_log_listener
+import ratelimit
+
+
+# Recursos criados e liberados por cada worker
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_log_listener()
+    init_pool()
+    app.state.rate_limit_backend = ratelimit.create_backend()
+    init_store(REDIS_URL)
+    scheduler.register(
+        "warm_analytics",
+        warm_analytics,
+        interval=ANALYTICS_REFRESH_INTERVAL,
+        on_startup=True,
+    )
+    scheduler.register("refresh_analytics", refresh_analytics)
+    scheduler.register("load_analytics", load_analytics)
+    await scheduler.start(REDIS_URL)
+    yield
+    await scheduler.stop()
+    clear_cache()
+    close_store()
+    close_pool()
+    await app.state.rate_limit_backend.close()
+    app.state.rate_limit_backend = None
+    stop_log_listener()
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+app.add_middleware(ratelimit.RateLimitMiddleware)
 
 app.include_router(product_router)
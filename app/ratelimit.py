@@ -0,0 +1,191 @@
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+from auth import get_current_user
+from config import (
+    RATE_LIMIT_CAPACITY,
+    RATE_LIMIT_REFILL_RATE,
+    RATE_LIMIT_REDIS_URL,
+)
+from logging_config import logger
+
+# Custo das rotas que não declararam um com @cost
+DEFAULT_COST = 1
+
+
+def cost(value: int):
+    """Declara quantos tokens do bucket do cliente a rota consome."""
+    def decorator(endpoint):
+        endpoint.rate_limit_cost = value
+        return endpoint
+    return decorator
+
+
+class InMemoryBackend:
+    """Token buckets guardados no próprio worker."""
+
+    # Acima desse número de buckets o usado há mais tempo é descartado
+    max_buckets = 10000
+
+    def __init__(self):
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def consume(self, keys: list[str], cost: int, capacity: int, rate: float):
+        # A requisição só passa se todos os buckets tiverem tokens, e só então são debitados
+        now = time.monotonic()
+        states = []
+        retry_after = 0.0
+        for key in keys:
+            tokens, last = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens < cost:
+                retry_after = max(retry_after, (cost - tokens) / rate)
+            states.append(tokens)
+        allowed = retry_after == 0.0
+        for key, tokens in zip(keys, states):
+            self.buckets[key] = (tokens - cost if allowed else tokens, now)
+            self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+        return allowed, retry_after
+
+    async def close(self):
+        self.buckets.clear()
+
+
+# Recarga e consumo dos buckets feitos de forma atômica no Redis
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local states = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local last = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - last) * rate)
+    if tokens < cost then
+        retry_after = math.max(retry_after, (cost - tokens) / rate)
+    end
+    states[i] = tokens
+end
+local allowed = 0
+if retry_after == 0 then
+    allowed = 1
+end
+for i, key in ipairs(KEYS) do
+    local tokens = states[i]
+    if allowed == 1 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisBackend:
+    """Token buckets compartilhados entre os workers através do Redis."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def consume(self, keys: list[str], cost: int, capacity: int, rate: float):
+        allowed, retry_after = await self.script(
+            keys=[f"ratelimit:{key}" for key in keys], args=[capacity, rate, cost]
+        )
+        return bool(allowed), float(retry_after)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_backend():
+    if RATE_LIMIT_REDIS_URL:
+        return RedisBackend(RATE_LIMIT_REDIS_URL)
+    return InMemoryBackend()
+
+
+class RateLimitMiddleware:
+    """Limita as requisições por IP e, com um token válido, também por usuário.
+
+    O backend é criado pelo lifespan do main.py em app.state.rate_limit_backend;
+    sem ele (lifespan não executado) as requisições não são limitadas.
+    """
+
+    def __init__(self, app, capacity: int = RATE_LIMIT_CAPACITY, rate: float = RATE_LIMIT_REFILL_RATE):
+        self.app = app
+        self.capacity = capacity
+        self.rate = rate
+        self._costs = None
+
+    async def __call__(self, scope, receive, send):
+        backend = None
+        if scope["type"] == "http":
+            backend = getattr(scope["app"].state, "rate_limit_backend", None)
+        if backend is None:
+            await self.app(scope, receive, send)
+            return
+
+        keys = await self._client_keys(scope)
+        request_cost = self._route_cost(scope)
+        try:
+            allowed, retry_after = await backend.consume(
+                keys, request_cost, self.capacity, self.rate
+            )
+        except Exception as e:
+            # Com o backend fora do ar a requisição é liberada
+            logger.error(f"Rate limit backend failed: {e}")
+            allowed = True
+
+        if not allowed:
+            logger.warning(f"Rate limit exceeded by {', '.join(keys)} on {scope['path']}")
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests"},
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _route_cost(self, scope):
+        # Só as rotas que declararam custo são verificadas
+        if self._costs is None:
+            self._costs = [
+                (route, route.endpoint.rate_limit_cost)
+                for route in scope["app"].routes
+                if hasattr(getattr(route, "endpoint", None), "rate_limit_cost")
+            ]
+        for route, route_cost in self._costs:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route_cost
+        return DEFAULT_COST
+
+    async def _client_keys(self, scope):
+        client = scope.get("client")
+        keys = [f"ip:{client[0] if client else 'unknown'}"]
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        user = await get_current_user(token)
+                        keys.append(f"user:{user.username}")
+                    except HTTPException:
+                        pass
+                break
+        return keys
@@ -1,6 +1,7 @@
-from datetime import timedelta
+from datetime import date, timedelta
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated, Optional
 from models import ProductBase, Product
@@ -14,15 +15,22 @@ from auth import (
     fake_users_db,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
-from database import get_db
+from database import get_db, get_connector, get_pooled_connector
+from export import ExportFormat, EXPORT_MEDIA_TYPES, stream_query
+from analytics import cached, top_products, best_customer, busiest_month, top_territories
+from jobs import scheduler
+from ratelimit import cost
 from logging_config import logger
 
 router = APIRouter()
 
+SALES_TABLES = ("sales_2015", "sales_2016", "sales_2017")
+
 
 ### Rota para Autenticação ###
 
 @router.post("/token")
+@cost(10)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
@@ -48,6 +56,7 @@ def read_root():
 ### Rota para READ ###
 
 @router.get("/products")
+@cost(1)
 async def get_products(
     db=Depends(get_db),
     page: Optional[int] = 0,
@@ -93,6 +102,7 @@ async def get_products(
 
 
 @router.get("/products/{id}")
+@cost(1)
 async def get_product(
     id: int,
     db=Depends(get_db),
@@ -135,6 +145,7 @@ async def add_product(
         db.commit()
         cursor.close()
         logger.info(f"Product added by user {current_user.username}: {product}")
+        scheduler.trigger("refresh_analytics")
         return {**product.model_dump(), "ProductKey": cursor.lastrowid}
     except Exception as e:
         db.rollback()
@@ -162,6 +173,7 @@ async def delete_product(
         db.commit()
         cursor.close()
         logger.info(f"Product with id {id} deleted by user {current_user.username}")
+        scheduler.trigger("refresh_analytics")
         return {"detail": "Product deleted"}
     except HTTPException as he:
         raise he
@@ -211,6 +223,7 @@ async def update_product(
         logger.info(
             f"Product with id {id} updated by user {current_user.username}: {product}"
         )
+        scheduler.trigger("refresh_analytics")
         return {**product.model_dump(), "ProductKey": id}
     except HTTPException as he:
         raise he
@@ -225,98 +238,90 @@ async def update_product(
 ### Tarefa 3 ###
 
 @router.get("/sales/top-products/category/{category}")
-async def top10_produtos_mais_vendidos(category: int, db=Depends(get_db)):
-    cursor = db.cursor()
-    query = """
-    select comb.ProductKey, comb.ProductName, sum(vendas) as total_vendas from(
-    select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod 
-    inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
-    inner join sales_2016 as s16 on s16.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
-    group by prod.Productkey
-    union all
-    select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod 
-    inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
-    inner join sales_2017 as s17 on s17.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
-    group by prod.Productkey
-    union all
-    select prod.ProductKey, prod.ProductName, count(prod.ProductKey) as vendas from products as prod 
-    inner join product_subcategories as ps on ps.ProductSubcategoryKey = prod.ProductSubcategoryKey
-    inner join sales_2015 as s15 on s15.ProductKey = prod.ProductKey where ps.ProductCategoryKey = %s
-    group by prod.Productkey
-    ) as comb group by comb.ProductKey, comb.ProductName order by total_vendas desc limit 10;
-    """
-    cursor.execute(
-        query,
-        (
-            category,
-            category,
-            category,
-        ),
-    )
-    result = cursor.fetchall()
-    cursor.close()
+@cost(10)
+async def top10_produtos_mais_vendidos(category: int, connector=Depends(get_pooled_connector)):
+    result = await cached(("top-products", category), top_products, connector, category)
     if not result:
         raise HTTPException(status_code=404, detail="Category not found")
     return result
 
 
 @router.get("/sales/best-customer/")
-async def cliente_com_mais_pedidos(db=Depends(get_db)):
-    cursor = db.cursor()
-    query = """
-    select comb.CustomerKey, comb.FirstName, comb.LastName, sum(compras) as total_compras from(
-    select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
-    inner join sales_2015 as s15 on s15.CustomerKey = cus.CustomerKey
-    group by cus.CustomerKey
-    union all
-    select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
-    inner join sales_2016 as s16 on s16.CustomerKey = cus.CustomerKey
-    group by cus.CustomerKey
-    union all
-    select cus.CustomerKey, cus.FirstName, cus.LastName, count(cus.CustomerKey) as compras from customers as cus
-    inner join sales_2017 as s17 on s17.CustomerKey = cus.CustomerKey
-    group by cus.CustomerKey
-    )as comb group by comb.CustomerKey, comb.FirstName, comb.LastName order by total_compras desc limit 1;
-    """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    cursor.close()
-    return result
+@cost(10)
+async def cliente_com_mais_pedidos(connector=Depends(get_pooled_connector)):
+    return await cached(("best-customer",), best_customer, connector)
 
 
 @router.get("/sales/busiest-month/")
-async def mes_com_mais_venda(db=Depends(get_db)):
-    cursor = db.cursor()
-    query = """
-    select comb.mes, sum(valor) as total_valor from(
-    select month(str_to_date(s15.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2015 as s15
-    inner join products as prod on prod.ProductKey = s15.ProductKey group by mes
-    union all
-    select month(str_to_date(s16.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2016 as s16
-    inner join products as prod on prod.ProductKey = s16.ProductKey group by mes
-    union all
-    select month(str_to_date(s17.OrderDate, '%m/%d/%Y')) as mes, round(sum(prod.ProductPrice),2) as valor from sales_2017 as s17
-    inner join products as prod on prod.ProductKey = s17.ProductKey group by mes
-    )as comb group by comb.mes order by total_valor desc limit 1;
-    """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    cursor.close()
-    return result
+@cost(10)
+async def mes_com_mais_venda(connector=Depends(get_pooled_connector)):
+    return await cached(("busiest-month",), busiest_month, connector)
 
 
 @router.get("/sales/top-territories/")
-async def territorios_com_vendas_acima_da_media(db=Depends(get_db)):
-    cursor = db.cursor()
-    query = """
-    select s17.TerritoryKey, round(sum(prod.ProductPrice),2) as valor_acima_media from sales_2017 as s17
-    inner join products as prod on prod.ProductKey = s17.Productkey group by s17.TerritoryKey
-    having round(sum(prod.ProductPrice),2) >= (
-    select round(sum(prod.ProductPrice),2) / count(distinct TerritoryKey) as valor from sales_2017 as s17
-    inner join products as prod on prod.ProductKey = s17.Productkey
-    ) order by valor_acima_media desc;
-    """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    cursor.close()
-    return result
+@cost(10)
+async def territorios_com_vendas_acima_da_media(connector=Depends(get_pooled_connector)):
+    return await cached(("top-territories",), top_territories, connector)
+
+
+### Rota para JOBS ###
+
+@router.get("/jobs")
+async def get_jobs(
+    _=Depends(admin_required),
+):
+    return scheduler.status()
+
+
+### Rotas para EXPORT ###
+
+# As exportações usam uma conexão própria, fora do pool, aberta e fechada
+# pelo stream_query somente durante o streaming
+def export_response(connector, query: str, params, format: ExportFormat, name: str):
+    return StreamingResponse(
+        stream_query(connector, query, params, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
+
+
+@router.get("/export/products")
+@cost(20)
+async def export_products(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    connector=Depends(get_connector),
+    _=Depends(admin_required),
+    format: ExportFormat = "csv",
+    since: Optional[int] = None,
+):
+    # Products não tem data de alteração, a extração incremental usa o ProductKey
+    query = "SELECT * FROM products"
+    params = []
+    if since is not None:
+        query += " WHERE ProductKey > %s"
+        params.append(since)
+    query += " ORDER BY ProductKey"
+    logger.info(f"Products exported as {format} by user {current_user.username} (since={since})")
+    return export_response(connector, query, params, format, "products")
+
+
+@router.get("/export/sales")
+@cost(20)
+async def export_sales(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    connector=Depends(get_connector),
+    _=Depends(admin_required),
+    format: ExportFormat = "csv",
+    since: Optional[date] = None,
+):
+    selects = []
+    params = []
+    for table in SALES_TABLES:
+        select = "SELECT * FROM {}".format(table)
+        if since is not None:
+            select += " WHERE str_to_date(OrderDate, %s) >= %s"
+            params.extend(["%m/%d/%Y", since])
+        selects.append(select)
+    query = " UNION ALL ".join(selects)
+    logger.info(f"Sales exported as {format} by user {current_user.username} (since={since})")
+    return export_response(connector, query, params, format, "sales")
@@ -0,0 +1,14 @@
+import uvicorn
+
+from config import HOST, PORT, WEB_CONCURRENCY, GRACEFUL_SHUTDOWN_TIMEOUT
+
+# Perfil de produção: vários workers e shutdown que espera as requisições em andamento
+if __name__ == "__main__":
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        proxy_headers=True,
+    )
@@ -1,8 +1,23 @@
+import asyncio
+import logging
+import logging.handlers
 import sqlite3
+import time
 import pytest
 from fastapi.testclient import TestClient
 from main import app
-from database import get_db
+from decimal import Decimal
+import database
+from database import get_db, get_connector, get_connection, get_pooled_connector, parse_database_url
+from fastapi import HTTPException
+from mysql.connector.errors import PoolError
+from export import stream_query
+import pyarrow as pa
+import pyarrow.ipc as pa_ipc
+from mysql.connector.constants import FieldType
+from jobs import Scheduler
+import analytics
+import ratelimit
 
 
 def dict_factory(cursor, row):
@@ -48,6 +63,13 @@ def dbTest():
         conn.close()
 
 
+@pytest.fixture(autouse=True)
+def resetRateLimit():
+    app.state.rate_limit_backend = ratelimit.InMemoryBackend()
+    yield
+    app.state.rate_limit_backend = None
+
+
 client = TestClient(app)
 
 def get_access_token(username: str, password: str):
@@ -267,3 +289,428 @@ def test_put_product_fail():
 
     assert response.status_code == 404
     assert response.json() == {"detail": "Product not found"}
+
+
+### Testes EXPORT ###
+
+@pytest.fixture
+def exportDb():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE products (ProductKey INTEGER PRIMARY KEY, ProductName TEXT, ProductPrice REAL)')
+    cursor.execute("INSERT INTO products VALUES (1, 'abc', 200), (2, 'def', 300)")
+    for table in ("sales_2015", "sales_2016", "sales_2017"):
+        cursor.execute(f'CREATE TABLE {table} (OrderDate TEXT, ProductKey INT, CustomerKey INT)')
+        cursor.execute(f"INSERT INTO {table} VALUES ('1/1/2016', 1, 10)")
+    conn.commit()
+
+    app.dependency_overrides[get_connector] = lambda: (lambda: conn)
+    try:
+        yield conn
+    finally:
+        app.dependency_overrides.pop(get_connector, None)
+
+
+class StubCursor:
+    # Cursor com o description no formato do mysql.connector
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = connection.description
+        self.rows = list(connection.rows)
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((query, params))
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+class StubConnection:
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+        self.executed = []
+        self.closed = False
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stubConnector():
+    connections = []
+
+    def connector():
+        conn = StubConnection(
+            [
+                ("ProductKey", FieldType.LONG, None, None, None, None, 0, 0, 63),
+                ("ProductCost", FieldType.NEWDECIMAL, None, None, None, None, 1, 0, 63),
+                ("ProductName", FieldType.VAR_STRING, None, None, None, None, 1, 0, 45),
+            ],
+            [(1, Decimal("1.5000"), None), (2, Decimal("12345.6789"), "abc")],
+        )
+        connections.append(conn)
+        return conn
+
+    app.dependency_overrides[get_connector] = lambda: connector
+    try:
+        yield connections
+    finally:
+        app.dependency_overrides.pop(get_connector, None)
+
+def test_export_products_csv(exportDb):
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/products",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        '"ProductKey","ProductName","ProductPrice"',
+        '1,"abc",200',
+        '2,"def",300',
+    ]
+
+def test_export_sales_arrow(exportDb):
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/sales?format=arrow",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    table = pa_ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 3
+    assert table.column_names == ["OrderDate", "ProductKey", "CustomerKey"]
+
+def test_export_products_parquet(exportDb):
+    import io
+    import pyarrow.parquet as pq
+
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/products?format=parquet",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.to_pydict() == {
+        "ProductKey": [1, 2],
+        "ProductName": ["abc", "def"],
+        "ProductPrice": [200.0, 300.0],
+    }
+
+def test_export_products_since(stubConnector):
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/products?since=1",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    query, params = stubConnector[0].executed[0]
+    assert query == "SELECT * FROM products WHERE ProductKey > %s ORDER BY ProductKey"
+    assert params == [1]
+    assert stubConnector[0].closed
+
+def test_export_sales_since(stubConnector):
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/sales?since=2016-01-01",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    query, params = stubConnector[0].executed[0]
+    assert query.count("WHERE str_to_date(OrderDate, %s) >= %s") == 3
+    assert len(params) == 6
+
+def test_export_batches_with_varying_types(stubConnector):
+    import io
+    import pyarrow.parquet as pq
+
+    connector = app.dependency_overrides[get_connector]()
+    data = b"".join(stream_query(connector, "SELECT", [], "parquet", batch_size=1))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.schema.field("ProductCost").type == pa.decimal128(38, 4)
+    assert table.to_pydict() == {
+        "ProductKey": [1, 2],
+        "ProductCost": [Decimal("1.5000"), Decimal("12345.6789")],
+        "ProductName": [None, "abc"],
+    }
+
+def test_export_decimal_without_scale():
+    conn = StubConnection(
+        [("ProductCost", FieldType.NEWDECIMAL, None, None, None, None, 1, 0, 63)],
+        [(None,), (Decimal("2.50"),)],
+    )
+    data = b"".join(stream_query(lambda: conn, "SELECT", [], "arrow", batch_size=1))
+    table = pa_ipc.open_stream(data).read_all()
+    assert table.schema.field("ProductCost").type == pa.string()
+    assert table.column("ProductCost").to_pylist() == [None, "2.50"]
+
+def test_export_fail_does_not_connect(stubConnector):
+    token = get_access_token("admin", "secret")
+    for url in ("/export/products?format=xml", "/export/sales?since=abc"):
+        response = client.get(url, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 422
+    assert stubConnector == []
+
+def test_export_products_unauthorized():
+    token = get_access_token_fail("admin", "nenhuma")
+    response = client.get(
+        "/export/products",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 401
+
+def test_export_products_fail(exportDb):
+    token = get_access_token("admin", "secret")
+    response = client.get(
+        "/export/products?format=xml",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 422
+
+
+### Testes JOBS ###
+
+def test_get_jobs():
+    with TestClient(app) as lifespanClient:
+        token = lifespanClient.post(
+            "/token", data={"username": "admin", "password": "secret"}
+        ).json()["access_token"]
+        for _ in range(50):
+            response = lifespanClient.get(
+                "/jobs",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            jobs = {job["name"]: job for job in response.json()}
+            if jobs["warm_analytics"]["last_duration"] is not None:
+                break
+            time.sleep(0.1)
+    assert response.status_code == 200
+    assert jobs["warm_analytics"]["runs"] >= 1
+    assert jobs["warm_analytics"]["last_duration"] is not None
+
+def test_get_jobs_unauthorized():
+    token = get_access_token_fail("admin", "nenhuma")
+    response = client.get(
+        "/jobs",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 401
+
+def test_scheduler_trigger():
+    calls = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    async def run():
+        scheduler = Scheduler()
+        scheduler.register("startup", lambda: calls.append("startup"), on_startup=True)
+        scheduler.register("triggered", lambda: calls.append("triggered"))
+        scheduler.register("fail", fail)
+        await scheduler.start()
+        scheduler.trigger("triggered")
+        scheduler.trigger("fail")
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+        return {job["name"]: job for job in scheduler.status()}
+
+    status = asyncio.run(run())
+    assert sorted(calls) == ["startup", "triggered"]
+    assert status["startup"]["runs"] == 1
+    assert status["startup"]["last_status"] == "success"
+    assert status["startup"]["last_duration"] is not None
+    assert status["fail"]["last_status"] == "failed"
+    assert status["fail"]["last_error"] == "boom"
+
+
+def test_cached_skips_empty_results():
+    analytics.clear_cache()
+    connector = lambda: sqlite3.connect(':memory:')
+    assert asyncio.run(analytics.cached(("top-products", -1), lambda db: [], connector)) == []
+    assert ("top-products", -1) not in analytics.analytics_cache
+    result = asyncio.run(analytics.cached(("top-products", 1), lambda db: [(1, "abc", 2)], connector))
+    assert result == [(1, "abc", 2)]
+    assert analytics.analytics_cache[("top-products", 1)] == [(1, "abc", 2)]
+    analytics.clear_cache()
+
+@pytest.fixture
+def warmedCache():
+    def connector():
+        raise AssertionError("cache hit should not open a connection")
+
+    analytics.clear_cache()
+    analytics.analytics_cache.update({
+        ("best-customer",): [[11000, "Jon", "Yang", 20]],
+        ("top-products", 1): [[1, "abc", 5]],
+        analytics.CATEGORIES_KEY: [1],
+    })
+    app.dependency_overrides[get_pooled_connector] = lambda: connector
+    try:
+        yield analytics.analytics_cache
+    finally:
+        app.dependency_overrides.pop(get_pooled_connector, None)
+        analytics.clear_cache()
+
+def test_sales_from_cache(warmedCache):
+    response = client.get("/sales/best-customer/")
+    assert response.status_code == 200
+    assert response.json() == [[11000, "Jon", "Yang", 20]]
+    response = client.get("/sales/top-products/category/1")
+    assert response.status_code == 200
+
+def test_sales_unknown_category_from_cache(warmedCache):
+    response = client.get("/sales/top-products/category/99")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Category not found"}
+
+class FakeSnapshotStore:
+    def __init__(self, snapshot=None, locked=False):
+        self.snapshot = snapshot
+        self.locked = locked
+        self.published = False
+
+    def load(self):
+        return self.snapshot
+
+    def save(self, results):
+        self.snapshot = (time.time(), results)
+
+    def acquire(self):
+        return not self.locked
+
+    def release(self):
+        pass
+
+    def publish_load(self):
+        self.published = True
+
+def test_warm_analytics_reuses_fresh_snapshot(monkeypatch):
+    store = FakeSnapshotStore((time.time(), {("best-customer",): [[1]]}), locked=True)
+    monkeypatch.setattr(analytics, "_store", store)
+    monkeypatch.setattr(analytics, "compute_analytics", lambda: pytest.fail("should not compute"))
+    analytics.warm_analytics()
+    assert analytics.analytics_cache == {("best-customer",): [[1]]}
+    analytics.clear_cache()
+
+def test_refresh_analytics_computes_and_publishes(monkeypatch):
+    store = FakeSnapshotStore((time.time(), {("best-customer",): [[1]]}))
+    monkeypatch.setattr(analytics, "_store", store)
+    monkeypatch.setattr(analytics, "compute_analytics", lambda: {("best-customer",): [[2]]})
+    analytics.refresh_analytics()
+    assert analytics.analytics_cache == {("best-customer",): [[2]]}
+    assert store.snapshot[1] == {("best-customer",): [[2]]}
+    assert store.published
+    analytics.clear_cache()
+
+
+### Testes DATABASE ###
+
+def test_parse_database_url():
+    config = parse_database_url("mysql://user:p%40ss@db:3307/adventure")
+    assert config["host"] == "db"
+    assert config["port"] == 3307
+    assert config["user"] == "user"
+    assert config["password"] == "p@ss"
+    assert config["database"] == "adventure"
+
+
+def test_get_connection_pool_exhausted(monkeypatch):
+    class ExhaustedPool:
+        def get_connection(self):
+            raise PoolError("Failed getting connection; pool exhausted")
+
+    monkeypatch.setattr(database, "_pool", ExhaustedPool())
+    monkeypatch.setattr(database, "DB_POOL_TIMEOUT", 0.1)
+    with pytest.raises(HTTPException) as error:
+        get_connection()
+    assert error.value.status_code == 503
+
+def test_get_connection_without_pool(monkeypatch):
+    class Pool:
+        def __init__(self, **kwargs):
+            raise database.mysql.connector.Error("Can't connect to MySQL server")
+
+    monkeypatch.setattr(database, "_pool", None)
+    monkeypatch.setattr(database, "_last_pool_attempt", float("-inf"))
+    monkeypatch.setattr(database.pooling, "MySQLConnectionPool", Pool)
+    monkeypatch.setattr(database, "connect", lambda: pytest.fail("should not bypass the pool"))
+    with pytest.raises(HTTPException) as error:
+        get_connection()
+    assert error.value.status_code == 503
+
+    class ReadyPool:
+        def __init__(self, **kwargs):
+            pass
+
+        def get_connection(self):
+            return "conn"
+
+    monkeypatch.setattr(database.pooling, "MySQLConnectionPool", ReadyPool)
+    monkeypatch.setattr(database, "_last_pool_attempt", float("-inf"))
+    assert get_connection() == "conn"
+
+def test_lifespan():
+    handlers = logging.getLogger().handlers[:]
+    with TestClient(app) as lifespanClient:
+        assert isinstance(logging.getLogger().handlers[0], logging.handlers.QueueHandler)
+        response = lifespanClient.get("/")
+        assert response.status_code == 200
+    assert logging.getLogger().handlers == handlers
+    assert database._pool is None
+
+
+### Testes RATE LIMIT ###
+
+def test_rate_limit_token():
+    for _ in range(6):
+        get_access_token_fail("admin", "nenhuma")
+    response = client.post("/token", data={"username": "admin", "password": "nenhuma"})
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many requests"}
+    assert int(response.headers["Retry-After"]) > 0
+
+def test_rate_limit_per_user():
+    token = get_access_token("admin", "secret")
+    for _ in range(100):
+        response = client.get("/jobs", headers={"Authorization": f"Bearer {token}"})
+        if response.status_code == 429:
+            break
+    assert response.status_code == 429
+    buckets = app.state.rate_limit_backend.buckets
+    assert "user:admin" in buckets
+    assert "ip:testclient" in buckets
+
+def test_in_memory_backend():
+    backend = ratelimit.InMemoryBackend()
+
+    async def run():
+        first = await backend.consume(["ip:1"], 10, 10, 1)
+        second = await backend.consume(["ip:1"], 1, 10, 1)
+        other = await backend.consume(["ip:2"], 10, 10, 1)
+        both = await backend.consume(["ip:2", "user:a"], 1, 10, 1)
+        return first, second, other, both
+
+    first, second, other, both = asyncio.run(run())
+    assert first == (True, 0.0)
+    assert second[0] is False and 0 < second[1] <= 1
+    assert other == (True, 0.0)
+    assert both[0] is False
+    assert backend.buckets["user:a"][0] == 10
+
+def test_in_memory_backend_evicts_least_recent():
+    backend = ratelimit.InMemoryBackend()
+    backend.max_buckets = 2
+
+    async def run():
+        for key in ("ip:1", "ip:2", "ip:1", "ip:3"):
+            await backend.consume([key], 1, 10, 1)
+
+    asyncio.run(run())
+    assert list(backend.buckets) == ["ip:1", "ip:3"]